@@ -0,0 +1,40 @@
+"""Compile the trained random forest into a native shared library with Treelite.
+
+Requires the optional `treelite` and `tl2cgen` packages:
+
+    pip install treelite tl2cgen
+    python compile_model.py
+
+main.py picks up the compiled library automatically on startup.
+"""
+import argparse
+
+import joblib
+import tl2cgen
+import treelite.sklearn
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile house_price_model.pkl with Treelite")
+    parser.add_argument("--model", default="house_price_model.pkl", help="Path to the trained sklearn model")
+    parser.add_argument("--libpath", default="./house.so", help="Where to write the compiled shared library")
+    parser.add_argument("--toolchain", default="gcc", help="C compiler used to build the library")
+    parser.add_argument("--parallel-comp", type=int, default=8, help="Number of source files to split the trees into")
+    parser.add_argument(
+        "--no-quantize",
+        action="store_true",
+        help="Compare raw float features instead of integer bin indices of the split thresholds"
+    )
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    treelite_model = treelite.sklearn.import_model(model)
+    tl2cgen.export_lib(
+        treelite_model,
+        toolchain=args.toolchain,
+        libpath=args.libpath,
+        params={"parallel_comp": args.parallel_comp, "quantize": 0 if args.no_quantize else 1}
+    )
+    print(f"Compiled {args.model} to {args.libpath}")
+
+if __name__ == "__main__":
+    main()
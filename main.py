@@ -1,45 +1,203 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+import os
+
+# Keep BLAS/OpenMP single-threaded per process; throughput scales with uvicorn workers instead.
+# This has to run before numpy and sklearn are imported.
+for _var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, BeforeValidator, Field, TypeAdapter, ValidationError, WithJsonSchema
+from pydantic_core import PydanticCustomError
+from anyio import to_thread
 import joblib
 import numpy as np
-from typing import List, Optional
-import logging
-import datetime
+import orjson
+from typing import Annotated, List, Optional
+import asyncio
+import atexit
+import email.message
 import json
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.linear_model import LinearRegression
+from itertools import product
+from operator import attrgetter
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Configure enhanced logging; set LOG_LEVEL=INFO or DEBUG to log individual requests
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "WARNING").upper()
 
-# Configure enhanced logging
+# Handlers run on a listener thread so file writes never block the event loop
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler('api.log'),
+    logging.StreamHandler()
+)
 logging.basicConfig(
-    level=logging.INFO,
+    level=LOG_LEVEL,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('api.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Load your trained model
-model = joblib.load("house_price_model.pkl")
+MODEL_PATH = "house_price_model.pkl"
+model = joblib.load(MODEL_PATH)
+
+# The forest was trained with n_jobs=-1; predictions already run on one thread per core,
+# so each predict call must stay on its own thread instead of fanning out to every core
+if hasattr(model, "n_jobs"):
+    model.n_jobs = 1
+
+# Optional Treelite-compiled version of the model, built by compile_model.py
+COMPILED_MODEL_PATH = "./house.so"
+
+def load_predictor():
+    """Return the prediction function: the compiled model if it was built, a NumPy dot
+    product for linear models, else model.predict"""
+    if os.path.exists(COMPILED_MODEL_PATH):
+        try:
+            import tl2cgen
+        except ImportError:
+            logger.warning("%s found but tl2cgen is not installed; using model.predict", COMPILED_MODEL_PATH)
+        else:
+            predictor = tl2cgen.Predictor(COMPILED_MODEL_PATH, nthread=1)
+            logger.info("Using compiled model from %s", COMPILED_MODEL_PATH)
+            return lambda features: predictor.predict(tl2cgen.DMatrix(features)).reshape(-1)
+    from sklearn.linear_model import LinearRegression
+    if isinstance(model, LinearRegression):
+        # Skip sklearn's per-call validation; one dot product covers single rows and batches
+        coef = np.ascontiguousarray(model.coef_, dtype=np.float64)
+        intercept = float(model.intercept_)
+        return lambda features: features @ coef + intercept
+    return model.predict
+
+predict_fn = load_predictor()
+
+app = FastAPI(
+    title="House Price Prediction API",
+    description="API for predicting house prices",
+    default_response_class=ORJSONResponse
+)
+
+def _has_wide_number(value) -> bool:
+    """Whether a decoded JSON value holds a float outside the 64-bit integer range"""
+    if isinstance(value, float):
+        return abs(value) >= 2 ** 64
+    if isinstance(value, dict):
+        return any(map(_has_wide_number, value.values()))
+    if isinstance(value, list):
+        return any(map(_has_wide_number, value))
+    return False
+
+def loads_json(body: bytes):
+    """Decode JSON with orjson, falling back to the stdlib json module where the two differ
+
+    orjson turns integers wider than 64 bits into floats, and its decode errors are worded
+    differently, so those bodies are re-parsed with json and behave as they did with
+    FastAPI's default parser.
+    """
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return json.loads(body)
+    if _has_wide_number(data):
+        return json.loads(body)
+    return data
+
+class ORJSONRequest(Request):
+    """Request that decodes its JSON body with orjson instead of the stdlib json module"""
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = loads_json(await self.body())
+        return self._json
 
-app = FastAPI(title="House Price Prediction API", description="API for predicting house prices")
+class ORJSONRoute(APIRoute):
+    """Route that hands ORJSONRequest objects to FastAPI's body parsing"""
+    def get_route_handler(self):
+        route_handler = super().get_route_handler()
+
+        async def orjson_route_handler(request: Request):
+            return await route_handler(ORJSONRequest(request.scope, request.receive))
+
+        return orjson_route_handler
+
+# Must be set before any routes are declared
+app.router.route_class = ORJSONRoute
+
+# Micro-batching settings for /predict
+MAX_BATCH = 64
+MAX_WAIT_MS = 5
+
+# Queue of (input, future) pairs, created when the batcher starts
+predict_queue: Optional[asyncio.Queue] = None
+batcher_task: Optional[asyncio.Task] = None
+
+# Batches larger than this are streamed back in chunks of this many predictions
+STREAM_CHUNK_SIZE = 1024
+
+# Optional PredictionOutput fields, written out explicitly where responses skip response_model
+_EMPTY_PREDICTION = {
+    "confidence_score": None,
+    "prediction_interval_lower": None,
+    "prediction_interval_upper": None
+}
+
+def _case_variants(word: str) -> List[str]:
+    """Every upper/lower-case spelling of a word"""
+    return [''.join(chars) for chars in product(*((c.lower(), c.upper()) for c in word))]
+
+# Binary categorical mapping, keyed on every spelling of yes/no so .lower() never runs for them
+_BIN = {
+    **{variant: 1 for variant in _case_variants('yes')},
+    **{variant: 0 for variant in _case_variants('no')}
+}
+
+# Furnishing status mapping, common spellings first so .lower() only runs on a miss
+_FURN = {
+    'furnished': 2, 'Furnished': 2, 'FURNISHED': 2,
+    'semi-furnished': 1, 'Semi-furnished': 1, 'Semi-Furnished': 1, 'SEMI-FURNISHED': 1,
+    'unfurnished': 0, 'Unfurnished': 0, 'UNFURNISHED': 0
+}
+
+def _lookup(mapping: dict, value: str) -> int:
+    try:
+        return mapping[value]
+    except KeyError:
+        return mapping.get(value.lower(), 0)
+
+def _categorical(mapping: dict):
+    """Build a validator that accepts a category string and returns its integer code"""
+    def encode(value):
+        if not isinstance(value, str):
+            # Same error pydantic raises for a plain str field
+            raise PydanticCustomError("string_type", "Input should be a valid string")
+        return _lookup(mapping, value)
+    return encode
+
+# Categorical fields are sent as strings and stored as their integer codes
+BinaryFeature = Annotated[int, BeforeValidator(_categorical(_BIN)), WithJsonSchema({"type": "string"})]
+FurnishingFeature = Annotated[int, BeforeValidator(_categorical(_FURN)), WithJsonSchema({"type": "string"})]
 
 # Define input schema
 class PredictionInput(BaseModel):
-    area: float
+    area: float = Field(allow_inf_nan=False)
     bedrooms: int
     bathrooms: int
     stories: int
-    mainroad: str
-    guestroom: str
-    basement: str
-    hotwaterheating: str
-    airconditioning: str
+    mainroad: BinaryFeature
+    guestroom: BinaryFeature
+    basement: BinaryFeature
+    hotwaterheating: BinaryFeature
+    airconditioning: BinaryFeature
     parking: int
-    prefarea: str
-    furnishingstatus: str
+    prefarea: BinaryFeature
+    furnishingstatus: FurnishingFeature
 
 class PredictionOutput(BaseModel):
     prediction: float
@@ -54,99 +212,250 @@ class BatchPredictionInput(BaseModel):
 class BatchPredictionOutput(BaseModel):
     predictions: List[PredictionOutput]
 
+# Validates raw /batch-predict bodies straight from JSON
+batch_input_adapter = TypeAdapter(BatchPredictionInput)
+
+# PredictionInput is already in the OpenAPI components through /predict, so refs point there
+BATCH_INPUT_SCHEMA = BatchPredictionInput.model_json_schema(ref_template="#/components/schemas/{model}")
+BATCH_INPUT_SCHEMA.pop("$defs", None)
+
+# FastAPI only documents 422 for declared bodies; HTTPValidationError is in the components through /predict
+VALIDATION_ERROR_RESPONSE = {
+    "description": "Validation Error",
+    "content": {"application/json": {"schema": {"$ref": "#/components/schemas/HTTPValidationError"}}}
+}
+
+# Feature matrix dtype; tree models predict in float32, so this avoids a conversion copy
+FEATURE_DTYPE = np.float32
+
+# Model features, in training order
+FEATURE_NAMES = [
+    "area", "bedrooms", "bathrooms", "stories", "mainroad", "guestroom", "basement",
+    "hotwaterheating", "airconditioning", "parking", "prefarea", "furnishingstatus"
+]
+_COLUMN_GETTERS = [attrgetter(name) for name in FEATURE_NAMES]
+
 # Feature encoding functions
-def encode_categorical_features(input_data: PredictionInput):
-    """Convert categorical string features to numerical values for model prediction"""
-    
-    # Binary categorical mappings
-    binary_mapping = {'yes': 1, 'no': 0}
-    
-    # Furnishing status mapping
-    furnishing_mapping = {
-        'furnished': 2,
-        'semi-furnished': 1, 
-        'unfurnished': 0
-    }
-    
-    # Create feature array in the correct order
-    features = [
-        float(input_data.area),
-        int(input_data.bedrooms),
-        int(input_data.bathrooms),
-        int(input_data.stories),
-        binary_mapping.get(input_data.mainroad.lower(), 0),
-        binary_mapping.get(input_data.guestroom.lower(), 0),
-        binary_mapping.get(input_data.basement.lower(), 0),
-        binary_mapping.get(input_data.hotwaterheating.lower(), 0),
-        binary_mapping.get(input_data.airconditioning.lower(), 0),
-        int(input_data.parking),
-        binary_mapping.get(input_data.prefarea.lower(), 0),
-        furnishing_mapping.get(input_data.furnishingstatus.lower(), 0)
-    ]
-    
-    return np.array([features])
+def encode_rows(inputs: List[PredictionInput], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Encode a list of inputs into a single (N, 12) feature matrix for one model.predict call
+
+    The matrix is filled column by column, each column in one C-level pass over the inputs.
+    Pass `out` to fill a preallocated (N, 12) array instead of allocating a new one.
+    """
+    n = len(inputs)
+    features = np.empty((n, 12), dtype=FEATURE_DTYPE) if out is None else out
+    for column, getter in enumerate(_COLUMN_GETTERS):
+        features[:, column] = np.fromiter(map(getter, inputs), dtype=FEATURE_DTYPE, count=n)
+    return features
+
+async def run_prediction(features: np.ndarray) -> np.ndarray:
+    """Run predict_fn on a worker thread; the model releases the GIL while it predicts"""
+    return await to_thread.run_sync(predict_fn, features)
+
+async def batcher_loop():
+    """Coalesce queued /predict inputs into batches and run one model.predict per batch"""
+    loop = asyncio.get_running_loop()
+
+    # Reused for every batch; safe because the next batch is only built after predict returns
+    batch_buffer = np.empty((MAX_BATCH, 12), dtype=FEATURE_DTYPE)
+
+    while True:
+        batch = [await predict_queue.get()]
+        deadline = loop.time() + MAX_WAIT_MS / 1000
+
+        # Collect more inputs until the batch is full or the wait window closes
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(predict_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            features = encode_rows([input_data for input_data, _ in batch], out=batch_buffer[:len(batch)])
+            preds = await run_prediction(features)
+        except Exception as e:
+            # One bad row fails the whole call, so retry each row on its own and fail only that request
+            logger.warning("Batched prediction failed, retrying rows individually: %s", str(e))
+            for input_data, future in batch:
+                try:
+                    prediction = (await run_prediction(encode_rows([input_data])))[0]
+                except Exception as row_error:
+                    if not future.done():
+                        future.set_exception(row_error)
+                else:
+                    if not future.done():
+                        future.set_result(float(prediction))
+            continue
+
+        for (_, future), prediction in zip(batch, preds):
+            if not future.done():
+                future.set_result(float(prediction))
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on, which can be fewer than os.cpu_count()"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+@app.on_event("startup")
+async def limit_prediction_threads():
+    # One thread per usable core; the default 40 threads only oversubscribe the CPU for model.predict
+    to_thread.current_default_thread_limiter().total_tokens = available_cpus()
+
+@app.on_event("startup")
+async def warm_up_model():
+    """Run throwaway predictions so one-time setup costs are paid before the first request"""
+    # Single-row and full micro-batch shapes
+    predict_fn(np.zeros((1, 12), dtype=FEATURE_DTYPE))
+    predict_fn(np.zeros((MAX_BATCH, 12), dtype=FEATURE_DTYPE))
+    logger.info("Model warm-up complete")
+
+@app.on_event("startup")
+async def start_batcher():
+    global predict_queue, batcher_task
+    predict_queue = asyncio.Queue()
+    batcher_task = asyncio.create_task(batcher_loop())
 
 @app.get("/")
-def health_check():
+async def health_check():
     logger.info("Health check endpoint called.")
     return {"status": "healthy", "message": "House Price Prediction API is running"}
 
-@app.post("/predict", response_model=PredictionOutput)
-def predict(input_data: PredictionInput):
+# No response_model: the prediction is serialized straight from a dict; the schema is kept for the docs
+@app.post("/predict", responses={200: {"model": PredictionOutput}})
+async def predict(input_data: PredictionInput):
     try:
-        logger.info("Prediction endpoint called with input: %s", input_data)
+        logger.debug("Prediction endpoint called with input: %s", input_data)
         
-        # Encode categorical features properly
-        features = encode_categorical_features(input_data)
-        logger.info("Encoded features: %s", features)
+        # Make prediction, batched with concurrent requests when the batcher is running
+        if predict_queue is None:
+            features = encode_rows([input_data])
+            logger.debug("Encoded features: %s", features)
+            prediction = float((await run_prediction(features))[0])
+        else:
+            future = asyncio.get_running_loop().create_future()
+            await predict_queue.put((input_data, future))
+            prediction = await future
 
-        # Make prediction
-        prediction = model.predict(features)[0]
-
-        logger.info("Prediction made: %f", prediction)
+        logger.debug("Prediction made: %f", prediction)
 
         # Return prediction
-        return PredictionOutput(prediction=prediction)
+        return ORJSONResponse({**_EMPTY_PREDICTION, "prediction": prediction})
 
     except Exception as e:
         logger.error("Error during prediction: %s", str(e))
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/batch-predict", response_model=BatchPredictionOutput)
-def batch_predict(batch_input: BatchPredictionInput):
+async def stream_predictions(features: np.ndarray):
+    """Yield the batch response as JSON, predicting and serializing one chunk of rows at a time"""
+    yield b'{"predictions":['
+    try:
+        for start in range(0, len(features), STREAM_CHUNK_SIZE):
+            preds = await run_prediction(features[start:start + STREAM_CHUNK_SIZE])
+            chunk = orjson.dumps([{**_EMPTY_PREDICTION, "prediction": p} for p in preds.tolist()])
+            # Strip the list brackets so chunks join into one JSON array
+            yield (b"," if start else b"") + chunk[1:-1]
+    except Exception as e:
+        logger.error("Error during streamed batch prediction: %s", str(e))
+        raise
+    yield b"]}"
+
+def is_json_content_type(content_type: Optional[str]) -> bool:
+    """Whether FastAPI would parse a body sent with this content type as JSON"""
+    if not content_type:
+        return True
+    message = email.message.Message()
+    message["content-type"] = content_type
+    subtype = message.get_content_subtype()
+    return message.get_content_maintype() == "application" and (subtype == "json" or subtype.endswith("+json"))
+
+async def parse_batch_input(request: Request) -> BatchPredictionInput:
+    """Validate a batch request body, raising the same 422 errors as FastAPI's body parsing"""
+    body = await request.body()
+    if not body:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
     try:
-        logger.info("Batch prediction endpoint called with inputs: %s", batch_input)
-        predictions = []
-        for input_data in batch_input.inputs:
-            # Encode categorical features properly
-            features = encode_categorical_features(input_data)
+        if not is_json_content_type(request.headers.get("content-type")):
+            # FastAPI validates other content types as raw bytes, which the model rejects
+            return batch_input_adapter.validate_python(body, from_attributes=True)
+        # Parse and validate the whole batch in one pass in pydantic-core
+        try:
+            return batch_input_adapter.validate_json(body)
+        except ValidationError as e:
+            if not any(error["type"] == "json_invalid" for error in e.errors()):
+                raise
+        # Re-parse so decode errors report the position and message FastAPI would
+        try:
+            data = loads_json(body)
+        except json.JSONDecodeError as e:
+            raise RequestValidationError(
+                [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}],
+                body=e.doc
+            ) from e
+        return batch_input_adapter.validate_python(data)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        )
+
+# No response_model: predictions are serialized straight from dicts; the schema is kept for the docs.
+# The body is read raw and validated from JSON by batch_input_adapter, so its schema is declared here.
+@app.post(
+    "/batch-predict",
+    responses={200: {"model": BatchPredictionOutput}, 422: VALIDATION_ERROR_RESPONSE},
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/json": {"schema": BATCH_INPUT_SCHEMA}},
+            "required": True
+        }
+    }
+)
+async def batch_predict(request: Request):
+    batch_input = await parse_batch_input(request)
+
+    try:
+        logger.debug("Batch prediction endpoint called with %d inputs", len(batch_input.inputs))
+
+        # model.predict rejects a (0, 12) matrix, so answer empty batches directly
+        if not batch_input.inputs:
+            return ORJSONResponse({"predictions": []})
 
-            # Make prediction
-            prediction = model.predict(features)[0]
-            predictions.append(PredictionOutput(prediction=prediction))
+        # Encode all inputs into one feature matrix
+        features = encode_rows(batch_input.inputs)
 
-        logger.info("Batch predictions made: %s", predictions)
+        # Reject bad rows up front; once a streamed response has started it can no longer become a 400
+        if not np.isfinite(features).all():
+            raise ValueError("Input contains infinity or NaN")
+
+        # Stream the output of large batches chunk by chunk instead of building the whole response
+        if len(features) > STREAM_CHUNK_SIZE:
+            return StreamingResponse(stream_predictions(features), media_type="application/json")
+
+        # Make all predictions in a single call on a worker thread
+        preds = await run_prediction(features)
+        predictions = [{**_EMPTY_PREDICTION, "prediction": p} for p in preds.tolist()]
 
         # Return batch predictions
-        return BatchPredictionOutput(predictions=predictions)
+        return ORJSONResponse({"predictions": predictions})
 
     except Exception as e:
         logger.error("Error during batch prediction: %s", str(e))
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/model-info")
-def model_info():
+async def model_info():
     return {
         "model_type": "Linear Regression",
         "problem_type": "regression",
-        "features": ["area", "bedrooms", "bathrooms", "stories", "mainroad", "guestroom", "basement", "hotwaterheating", "airconditioning", "parking", "prefarea", "furnishingstatus"]
+        "features": FEATURE_NAMES
     }
 
-@app.get("/test-form", response_class=HTMLResponse)
-def get_test_form():
-    """Serve a simple HTML form for testing the prediction API"""
-    logger.info("Test form endpoint called")
-    html_content = """
+# Test form page, built once at import
+_TEST_FORM_HTML = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -393,4 +702,9 @@ def get_test_form():
     </body>
     </html>
     """
-    return html_content
+
+@app.get("/test-form", response_class=HTMLResponse)
+async def get_test_form():
+    """Serve a simple HTML form for testing the prediction API"""
+    logger.info("Test form endpoint called")
+    return HTMLResponse(_TEST_FORM_HTML)